@@ -20,13 +20,39 @@ References:
 Author: Your Name
 """
 
+import asyncio
+import contextlib
+import functools
 import os
+import shutil
 import sys
 import time
 import json
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Iterable, Optional
+
+# Optional: async download path (single event loop, no thread-pool jitter).
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Optional: HTTP/2 for the API-control calls (submit/poll/list). Many
+# independent requests then multiplex over one TCP+TLS session instead of
+# serializing on HTTP/1.1 keep-alive connections.
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from envutil import envjson
+except ImportError:  # imported as part of the STT package
+    from STT.envutil import envjson
 
 # ---------------------------
 # Configuration (env vars)
@@ -54,45 +80,100 @@ INPUT_CONTAINER_SAS_URL = os.getenv("INPUT_CONTAINER_SAS_URL", "")
 OUTPUT_CONTAINER_SAS_URL = os.getenv("OUTPUT_CONTAINER_SAS_URL", "")
 
 # Optional: phrase list to boost domain terms (if supported by your API version/model)
-PHRASES = json.loads(os.getenv("PHRASES_JSON", "[]"))  # e.g., '["Contoso", "Rehaan"]'
+PHRASES = envjson("PHRASES_JSON", "[]")  # e.g., '["Contoso", "Rehaan"]'
 
 # Polling controls
-POLL_INTERVAL_SECONDS = float(os.getenv("POLL_INTERVAL_SECONDS", "60"))  # 1 minute default
+# Start with short intervals so jobs that finish quickly are detected quickly;
+# the gentle 1.3 backoff keeps sampling dense early while the 10-minute cap
+# bounds total request count for long jobs.
+POLL_INTERVAL_SECONDS = float(os.getenv("POLL_INTERVAL_SECONDS", "2.0"))
 MAX_POLL_MINUTES = int(os.getenv("MAX_POLL_MINUTES", "180"))            # up to 3 hours
-BACKOFF_MULTIPLIER = float(os.getenv("BACKOFF_MULTIPLIER", "1.5"))       # exponential backoff
+BACKOFF_MULTIPLIER = float(os.getenv("BACKOFF_MULTIPLIER", "1.3"))       # exponential backoff
 
 # Download results locally
 DOWNLOAD_RESULTS = os.getenv("DOWNLOAD_RESULTS", "false").lower() == "true"
 DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "batch_results")
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))  # parallel result downloads
+MONITOR_CONCURRENCY = int(os.getenv("MONITOR_CONCURRENCY", "16"))  # in-flight status polls
+
+# ---------------------------
+# HTTP session
+# ---------------------------
+
+# One keep-alive session for every call (submit, polls, file listing, blob
+# downloads). Reusing pooled connections avoids a fresh TCP+TLS handshake per
+# poll, which matters when a job is polled for minutes or hours.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+    ),
+)
+SESSION.mount("https://", _adapter)
+
+# Auth is fixed for the process lifetime, so resolve the token-vs-key branch
+# once here and let the Session carry the header on every request. When
+# neither is configured, main() reports the problem before any call is made.
+if ENTRA_ACCESS_TOKEN:
+    _AUTH_HEADERS: Dict[str, str] = {"Authorization": f"Bearer {ENTRA_ACCESS_TOKEN}"}
+elif SPEECH_KEY and SPEECH_KEY != "<your-speech-key>":
+    _AUTH_HEADERS = {"Ocp-Apim-Subscription-Key": SPEECH_KEY}
+else:
+    _AUTH_HEADERS = {}
+SESSION.headers.update(_AUTH_HEADERS)
+
+# Control-plane client: submit/poll/list multiplex over HTTP/2 when httpx is
+# installed; blob downloads stay on SESSION, which supports raw streaming.
+if httpx is not None:
+    try:
+        API_CLIENT = httpx.Client(
+            http2=True,
+            timeout=60,
+            headers=_AUTH_HEADERS,
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=32),
+        )
+    except ImportError:
+        # httpx without the h2 extra raises from the transport constructor,
+        # not from `import httpx`; plain HTTP/1.1 via SESSION is fine then.
+        API_CLIENT = SESSION
+else:
+    API_CLIENT = SESSION
 
 # ---------------------------
 # Helpers
 # ---------------------------
 
+@functools.lru_cache(maxsize=1)
 def endpoint_base(region: str) -> str:
     # Batch transcription “create” (collection) endpoint
     return f"https://{region}.api.cognitive.microsoft.com/speechtotext/batchtranscriptions"
 
-def headers() -> Dict[str, str]:
-    if ENTRA_ACCESS_TOKEN:
-        return {"Authorization": f"Bearer {ENTRA_ACCESS_TOKEN}"}
-    elif SPEECH_KEY and SPEECH_KEY != "<your-speech-key>":
-        return {"Ocp-Apim-Subscription-Key": SPEECH_KEY}
-    else:
-        raise ValueError("Configure authentication: set ENTRA_ACCESS_TOKEN or SPEECH_KEY.")
+# Collection endpoint for the configured region, formatted once.
+_ENDPOINT = endpoint_base(SPEECH_REGION)
 
-def create_body() -> Dict[str, Any]:
+def create_body(content_urls: Optional[Iterable[str]] = None) -> Dict[str, Any]:
     """
-    Minimal request body to point the service at your input container and to write to your output container.
+    Minimal request body to point the service at your input audio and to write to your output container.
     Depending on the latest REST schema, 'recordingsUrl' (input) and 'resultsContainerUrl' (output) are typical.
+
+    Pass content_urls (per-blob SAS URLs) to scope the job to specific
+    files; without it the job covers the whole input container, so repeat
+    submitters would re-transcribe every blob already there.
     """
     body: Dict[str, Any] = {
         "displayName": DISPLAY_NAME,
         "description": DESCRIPTION,
         "locale": LOCALE,
-        "recordingsUrl": INPUT_CONTAINER_SAS_URL,      # Input container with audio files (SAS)
         "resultsContainerUrl": OUTPUT_CONTAINER_SAS_URL # Output container for transcription (SAS)
     }
+    if content_urls:
+        body["contentUrls"] = list(content_urls)        # Just these blobs (SAS)
+    else:
+        body["recordingsUrl"] = INPUT_CONTAINER_SAS_URL # Input container with audio files (SAS)
 
     # Optional: boost keywords via phrase list if supported by API/model
     if PHRASES:
@@ -101,15 +182,15 @@ def create_body() -> Dict[str, Any]:
             "diagnosticMode": False,
             "profanityFilterMode": "Masked",     # None|Masked|Removed|Tags
             "punctuationMode": "DictatedAndAutomatic",
-            "speechRecognitionPhrases": PHRASES
+            "speechRecognitionPhrases": list(PHRASES)
         }
 
     return body
 
-def submit_job() -> str:
-    url = f"{endpoint_base(SPEECH_REGION)}?api-version={API_VERSION}"
-    resp = requests.post(url, headers=headers(), json=create_body(), timeout=60)
-    if not resp.ok:
+def submit_job(content_urls: Optional[Iterable[str]] = None) -> str:
+    url = f"{_ENDPOINT}?api-version={API_VERSION}"
+    resp = API_CLIENT.post(url, json=create_body(content_urls), timeout=60)
+    if resp.status_code >= 400:
         print("Create failed:", resp.status_code, resp.text)
         resp.raise_for_status()
 
@@ -132,13 +213,15 @@ def submit_job() -> str:
     print(f"Submitted job: {job_id}")
     return job_id
 
-def get_job(job_id: str) -> Dict[str, Any]:
-    url = f"{endpoint_base(SPEECH_REGION)}/{job_id}?api-version={API_VERSION}"
-    resp = requests.get(url, headers=headers(), timeout=60)
-    if not resp.ok:
+def get_job(job_id: str):
+    # Returns the raw response (requests or httpx) so callers can also read
+    # headers (monitor_until_done honors Retry-After when the service sends one).
+    url = f"{_ENDPOINT}/{job_id}?api-version={API_VERSION}"
+    resp = API_CLIENT.get(url, timeout=60)
+    if resp.status_code >= 400:
         print("Get job failed:", resp.status_code, resp.text)
         resp.raise_for_status()
-    return resp.json()
+    return resp
 
 def list_files(job_id: str) -> Dict[str, Any]:
     """
@@ -146,9 +229,9 @@ def list_files(job_id: str) -> Dict[str, Any]:
     GET /batchtranscriptions/{id}/files
     If your version differs, consult the REST reference and adjust the path.
     """
-    url = f"{endpoint_base(SPEECH_REGION)}/{job_id}/files?api-version={API_VERSION}"
-    resp = requests.get(url, headers=headers(), timeout=60)
-    if not resp.ok:
+    url = f"{_ENDPOINT}/{job_id}/files?api-version={API_VERSION}"
+    resp = API_CLIENT.get(url, timeout=60)
+    if resp.status_code >= 400:
         print("List files failed:", resp.status_code, resp.text)
         resp.raise_for_status()
     return resp.json()
@@ -157,27 +240,57 @@ def download_file(file_url: str, out_dir: str) -> None:
     os.makedirs(out_dir, exist_ok=True)
     fname = os.path.basename(urllib.parse.urlparse(file_url).path)
     local_path = os.path.join(out_dir, fname or "result.json")
-    with requests.get(file_url, stream=True, timeout=300) as r:
+    with SESSION.get(file_url, stream=True, timeout=300) as r:
+        r.raise_for_status()
+        # Copy in 1 MB blocks straight off the raw stream: one C-level loop
+        # instead of a Python iteration per 8 KB chunk.
+        r.raw.decode_content = True
+        with open(local_path, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1024 * 1024)
+    print(f"Downloaded -> {local_path}")
+
+async def _download_file_async(session: "aiohttp.ClientSession", file_url: str, out_dir: str) -> None:
+    fname = os.path.basename(urllib.parse.urlparse(file_url).path)
+    local_path = os.path.join(out_dir, fname or "result.json")
+    async with session.get(file_url) as r:
         r.raise_for_status()
         with open(local_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+            async for chunk in r.content.iter_chunked(1024 * 1024):
+                f.write(chunk)
     print(f"Downloaded -> {local_path}")
 
+def download_files_async(urls: Iterable[str], out_dir: str) -> None:
+    """
+    Download many result blobs concurrently on one asyncio event loop via
+    aiohttp. All streams share a TCP connector, so the fan-out needs neither
+    worker threads nor per-file TLS handshakes.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    async def _run() -> None:
+        connector = aiohttp.TCPConnector(limit=DOWNLOAD_WORKERS)
+        timeout = aiohttp.ClientTimeout(total=300)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*(_download_file_async(session, u, out_dir) for u in urls))
+
+    asyncio.run(_run())
+
 def monitor_until_done(job_id: str) -> Dict[str, Any]:
     """
     Poll job status with exponential backoff up to MAX_POLL_MINUTES.
-    Recommended cadence: not more often than once per minute (docs advise ~10 minutes).
+    Starts dense (seconds) so short jobs are detected promptly, backs off
+    gently (x1.3), and defers to a Retry-After header whenever the service
+    sends one.
     """
     status = None
     waited = 0.0
     interval = POLL_INTERVAL_SECONDS
 
-    print(f"Polling job {job_id} every ~{int(interval)}s (up to {MAX_POLL_MINUTES} minutes)...")
+    print(f"Polling job {job_id} starting at ~{interval:.0f}s intervals (up to {MAX_POLL_MINUTES} minutes)...")
 
     while waited < MAX_POLL_MINUTES * 60:
-        job = get_job(job_id)
+        resp = get_job(job_id)
+        job = resp.json()
         status = job.get("status") or job.get("state")  # Typical enums: NotStarted | Running | Succeeded | Failed
 
         print(f"[+{int(waited)}s] Status: {status}")
@@ -185,12 +298,81 @@ def monitor_until_done(job_id: str) -> Dict[str, Any]:
         if status in ("Succeeded", "Failed", "Cancelled"):
             return job
 
+        # If the service asks us to slow down, honor it.
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                interval = max(float(retry_after), interval)
+            except ValueError:
+                pass
+
         time.sleep(interval)
         waited += interval
         interval = min(interval * BACKOFF_MULTIPLIER, 10 * 60)  # don’t exceed 10 minutes between polls
 
     raise TimeoutError(f"Job {job_id} did not complete within {MAX_POLL_MINUTES} minutes.")
 
+async def monitor_job_async(
+    session: "aiohttp.ClientSession",
+    job_id: str,
+    sem: Optional["asyncio.Semaphore"] = None,
+) -> Dict[str, Any]:
+    """
+    Async flavor of monitor_until_done: same cadence, backoff cap, and
+    Retry-After handling, but awaiting instead of blocking so many jobs can
+    be polled from one event loop. Pass a semaphore to cap how many status
+    polls are on the wire at once across jobs.
+    """
+    waited = 0.0
+    interval = POLL_INTERVAL_SECONDS
+    url = f"{_ENDPOINT}/{job_id}?api-version={API_VERSION}"
+
+    while waited < MAX_POLL_MINUTES * 60:
+        async with (sem or contextlib.nullcontext()):
+            async with session.get(url, headers=_AUTH_HEADERS) as resp:
+                resp.raise_for_status()
+                job = await resp.json()
+                retry_after = resp.headers.get("Retry-After")
+
+        status = job.get("status") or job.get("state")
+        print(f"[{job_id} +{int(waited)}s] Status: {status}")
+
+        if status in ("Succeeded", "Failed", "Cancelled"):
+            return job
+
+        if retry_after:
+            try:
+                interval = max(float(retry_after), interval)
+            except ValueError:
+                pass
+
+        await asyncio.sleep(interval)
+        waited += interval
+        interval = min(interval * BACKOFF_MULTIPLIER, 10 * 60)
+
+    raise TimeoutError(f"Job {job_id} did not complete within {MAX_POLL_MINUTES} minutes.")
+
+def monitor_jobs(job_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Monitor many batch jobs concurrently over one aiohttp session.
+    Returns {job_id: final job payload}. Requires aiohttp.
+    """
+    if aiohttp is None:
+        raise RuntimeError("aiohttp is required for concurrent job monitoring.")
+
+    ids = list(job_ids)
+
+    async def _run() -> Dict[str, Dict[str, Any]]:
+        # Hundreds of jobs can sleep concurrently for free, but only this
+        # many may have a GET in flight at the same instant.
+        sem = asyncio.Semaphore(MONITOR_CONCURRENCY)
+        connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=120)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            jobs = await asyncio.gather(*(monitor_job_async(session, jid, sem) for jid in ids))
+        return dict(zip(ids, jobs))
+
+    return asyncio.run(_run())
+
 def main():
     # Basic validation
     missing = []
@@ -216,7 +398,16 @@ def main():
 
     status = job.get("status") or job.get("state")
     print("\n=== Final Job Status ===")
-    print(json.dumps(job, indent=2))
+    if os.getenv("VERBOSE_JOB", "false").lower() == "true":
+        # Full pretty-printed payload; can be tens of MB for large jobs.
+        print(json.dumps(job, indent=2))
+    else:
+        print(json.dumps({
+            "id": job.get("id"),
+            "status": status,
+            "created": job.get("createdDateTime"),
+            "last_action": job.get("lastActionDateTime"),
+        }, indent=2))
 
     if status != "Succeeded":
         print("\nJob did not succeed. Exiting.")
@@ -233,6 +424,7 @@ def main():
 
     # Show and optionally download results
     print("\n=== Files ===")
+    to_download = []
     for f in files:
         name = f.get("name", "")
         kind = f.get("kind", "")
@@ -241,7 +433,16 @@ def main():
 
         # Download only 'transcription' or 'result' kinds unless you want logs too
         if DOWNLOAD_RESULTS and url and (("transcription" in (kind or "").lower()) or ("result" in (kind or "").lower())):
-            download_file(url, DOWNLOAD_DIR)
+            to_download.append(url)
+
+    if to_download:
+        if aiohttp is not None:
+            download_files_async(to_download, DOWNLOAD_DIR)
+        else:
+            # Downloads are I/O-bound and each worker writes a distinct path, so
+            # fan them out over the pooled SESSION (pool_maxsize >= workers).
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+                list(ex.map(lambda u: download_file(u, DOWNLOAD_DIR), to_download))
 
     print("\nDone.")
 
@@ -0,0 +1,25 @@
+"""
+Small environment-variable helpers shared by the STT clients.
+
+Deliberately free of Speech SDK imports so the pure-REST scripts (bt_api,
+ft_api) stay importable in environments that only have the HTTP stack.
+"""
+
+import json
+import logging
+import os
+import sys
+
+
+def envjson(name: str, default: str) -> tuple:
+    """
+    Parse a JSON-list env var into a tuple of interned strings. Malformed
+    input logs a warning and yields () instead of crashing at import, and
+    interning lets repeated request bodies reuse the same string objects.
+    """
+    try:
+        value = json.loads(os.getenv(name, default))
+    except Exception as e:
+        logging.warning("Ignoring malformed %s: %s", name, e)
+        return ()
+    return tuple(sys.intern(s) if isinstance(s, str) else s for s in value)
@@ -2,10 +2,12 @@ import json
 import os
 import sys
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any
 
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -27,14 +29,17 @@ Docs: Based on Microsoft Learn "Use the fast transcription API" (API version 202
 Author: Your Name
 """
 
-import json
-import os
-import sys
-import time
-from typing import Dict, Any, Optional
+# Optional: lazily-encoded multipart bodies so large audio files are streamed
+# to the socket instead of being buffered in memory first.
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
 
-import requests
-from requests import Response
+try:
+    from envutil import envjson
+except ImportError:  # imported as part of the STT package
+    from STT.envutil import envjson
 
 # Configuration via environment variables
 
@@ -55,17 +60,17 @@ AUDIO_URL = os.getenv("AUDIO_URL", "")
 
 # Optional transcription settings:
 
-LOCALES = json.loads(os.getenv("LOCALES_JSON", '["en-US"]'))
+LOCALES = envjson("LOCALES_JSON", '["en-US"]')
 
 # Enable diarization (speaker separation on a single channel)
 DIARIZATION_ENABLED = os.getenv("DIARIZATION_ENABLED", "false").lower() == "true"
 DIARIZATION_MAX_SPEAKERS = int(os.getenv("DIARIZATION_MAX_SPEAKERS", "2"))
 
 # Multi-channel (for stereo files).
-CHANNELS = json.loads(os.getenv("CHANNELS_JSON", "[]"))  # [] lets the service merge channels by default
+CHANNELS = envjson("CHANNELS_JSON", "[]")  # [] lets the service merge channels by default
 
 # Phrase list to boost domain-specific terms
-PHRASE_LIST = json.loads(os.getenv("PHRASE_LIST_JSON", '[]'))
+PHRASE_LIST = envjson("PHRASE_LIST_JSON", '[]')
 
 # Profanity filter
 PROFANITY_FILTER_MODE = os.getenv("PROFANITY_FILTER_MODE", "Masked")
@@ -74,27 +79,57 @@ PROFANITY_FILTER_MODE = os.getenv("PROFANITY_FILTER_MODE", "Masked")
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
 RETRY_BACKOFF_SECONDS = float(os.getenv("RETRY_BACKOFF_SECONDS", "2.0"))
 
+# Shared keep-alive session. GETs retry inside the transport; POSTs are
+# deliberately excluded because the streaming MultipartEncoder body cannot be
+# rewound once urllib3 has consumed it -- a transport-level replay would send
+# an empty stream. POST throttling is handled by _post_with_throttle_retry,
+# which rebuilds the body per attempt over the same pooled connection.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF_SECONDS,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+    ),
+))
+
+def _post_with_throttle_retry(send) -> Response:
+    """
+    Run send() -- one POST attempt -- retrying on 429 up to MAX_RETRIES,
+    honoring Retry-After. send is called fresh per attempt so streaming
+    bodies (file handles, MultipartEncoder) are rebuilt rather than replayed.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        resp = send()
+        if resp.status_code != 429 or attempt == MAX_RETRIES:
+            return resp
+        try:
+            wait = float(resp.headers.get("Retry-After", ""))
+        except ValueError:
+            wait = RETRY_BACKOFF_SECONDS * (attempt + 1)
+        print(f"429 throttled; retrying in {wait:.1f}s ({attempt + 1}/{MAX_RETRIES})")
+        time.sleep(wait)
+    return resp
+
+# Resolve the token-vs-key branch once and let the Session carry the auth
+# header; main() reports missing configuration before any request is made.
+if ENTRA_ACCESS_TOKEN:
+    _AUTH_HEADERS: Dict[str, str] = {"Authorization": f"Bearer {ENTRA_ACCESS_TOKEN}"}
+elif SPEECH_KEY and SPEECH_KEY != "<YourSpeechResourceKey>":
+    _AUTH_HEADERS = {"Ocp-Apim-Subscription-Key": SPEECH_KEY}
+else:
+    _AUTH_HEADERS = {}
+SESSION.headers.update(_AUTH_HEADERS)
+
 # Helper functions
 
 def build_endpoint(region: str, api_version: str) -> str:
     return f"https://{region}.api.cognitive.microsoft.com/speechtotext/transcriptions:transcribe?api-version={api_version}"
 
-def build_headers() -> Dict[str, str]:
-    """
-    Returns headers for authentication.
-    Prefers Entra ID token if provided, otherwise uses the subscription key.
-    """
-    if ENTRA_ACCESS_TOKEN:
-        return {
-            "Authorization": f"Bearer {ENTRA_ACCESS_TOKEN}",
-        }
-    elif SPEECH_KEY and SPEECH_KEY != "<YourSpeechResourceKey>":
-        return {
-            "Ocp-Apim-Subscription-Key": SPEECH_KEY,
-        }
-    else:
-        raise ValueError("No authentication configured. Set ENTRA_ACCESS_TOKEN or SPEECH_KEY.")
-
 def build_definition_payload() -> Dict[str, Any]:
     """
     Builds the 'definition' JSON object sent as a multipart field.
@@ -107,7 +142,7 @@ def build_definition_payload() -> Dict[str, Any]:
     # - Multiple locales: language identification among candidates.
     # - No locales (empty list): service uses latest multilingual model to ID and transcribe.
     if LOCALES:  # include only if user provided any locale(s)
-        definition["locales"] = LOCALES
+        definition["locales"] = list(LOCALES)
 
     # Diarization
     if DIARIZATION_ENABLED:
@@ -119,12 +154,12 @@ def build_definition_payload() -> Dict[str, Any]:
     # Multi-channel
     # Include only when explicitly specified; otherwise service merges channels.
     if CHANNELS:
-        definition["channels"] = CHANNELS
+        definition["channels"] = list(CHANNELS)
 
     # Phrase list (API version 2025-10-15 per docs)
     if PHRASE_LIST:
         definition["phraseList"] = {
-            "phrases": PHRASE_LIST
+            "phrases": list(PHRASE_LIST)
         }
 
     # Profanity filter
@@ -133,32 +168,13 @@ def build_definition_payload() -> Dict[str, Any]:
 
     return definition
 
-def post_with_retries(url: str, headers: Dict[str, str], files: Dict[str, Any]) -> Response:
-    """
-    POST with basic retry logic for 429 Too Many Requests.
-    """
-    attempt = 0
-    while True:
-        response = requests.post(url, headers=headers, files=files, timeout=300)
-        if response.status_code != 429:
-            return response
-
-        attempt += 1
-        if attempt > MAX_RETRIES:
-            return response
-
-        # Honor Retry-After if provided; otherwise exponential backoff
-        retry_after = response.headers.get("Retry-After")
-        if retry_after:
-            try:
-                wait = float(retry_after)
-            except ValueError:
-                wait = RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1))
-        else:
-            wait = RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1))
-
-        print(f"[{response.status_code}] Throttled. Retrying in {wait:.1f}s (attempt {attempt}/{MAX_RETRIES})...")
-        time.sleep(wait)
+# The definition only depends on env config, so build and serialize it once;
+# bulk callers then reuse the same bytes for every request instead of
+# re-building the dict and re-encoding JSON per file.
+_DEFINITION = build_definition_payload()
+_DEFINITION_JSON = json.dumps(_DEFINITION).encode()
+# URL-based variant carries the audio location inside the definition itself.
+_DEFINITION_URL_JSON = json.dumps({**_DEFINITION, "audioUrl": AUDIO_URL}).encode()
 
 def pretty_print_response(resp: Response) -> None:
     try:
@@ -198,20 +214,29 @@ def transcribe_inline_file() -> None:
         raise FileNotFoundError(f"AUDIO_FILE_PATH not found: {AUDIO_FILE_PATH}")
 
     url = build_endpoint(SPEECH_REGION, API_VERSION)
-    headers = build_headers()
-
-    definition = build_definition_payload()
-
-    with open(AUDIO_FILE_PATH, "rb") as f:
-        files = {
-            # form field 'audio' is the file contents
-            "audio": (os.path.basename(AUDIO_FILE_PATH), f, "application/octet-stream"),
-            # form field 'definition' is a JSON string
-            "definition": (None, json.dumps(definition), "application/json"),
-        }
+    print(f"POST {url}")
 
-        print(f"POST {url}")
-        resp = post_with_retries(url, headers, files)
+    def _send() -> Response:
+        # Fresh file handle and encoder per attempt: a consumed streaming
+        # body cannot be rewound for a retry.
+        with open(AUDIO_FILE_PATH, "rb") as f:
+            if MultipartEncoder is not None:
+                # Lazy encoder: the multipart body is generated as the socket
+                # drains, keeping memory O(chunk) regardless of audio size.
+                body = MultipartEncoder(fields={
+                    "audio": (os.path.basename(AUDIO_FILE_PATH), f, "application/octet-stream"),
+                    "definition": ("definition", _DEFINITION_JSON, "application/json"),
+                })
+                return SESSION.post(url, headers={"Content-Type": body.content_type}, data=body, timeout=300)
+            files = {
+                # form field 'audio' is the file contents
+                "audio": (os.path.basename(AUDIO_FILE_PATH), f, "application/octet-stream"),
+                # form field 'definition' is the pre-serialized JSON
+                "definition": (None, _DEFINITION_JSON, "application/json"),
+            }
+            return SESSION.post(url, files=files, timeout=300)
+
+    resp = _post_with_throttle_retry(_send)
 
     print(f"\nStatus: {resp.status_code}")
     if not resp.ok:
@@ -226,18 +251,15 @@ def transcribe_from_url() -> None:
         raise ValueError("AUDIO_URL is empty. Provide a public URL to your audio file.")
 
     url = build_endpoint(SPEECH_REGION, API_VERSION)
-    headers = build_headers()
-
-    definition = build_definition_payload()
-    # Add audioUrl into the definition for URL-based transcription
-    definition["audioUrl"] = AUDIO_URL
 
     files = {
-        "definition": (None, json.dumps(definition), "application/json"),
+        # Pre-serialized definition with audioUrl embedded
+        "definition": (None, _DEFINITION_URL_JSON, "application/json"),
     }
 
     print(f"POST {url}")
-    resp = post_with_retries(url, headers, files)
+    resp = _post_with_throttle_retry(
+        lambda: SESSION.post(url, files=files, timeout=300))
 
     print(f"\nStatus: {resp.status_code}")
     if not resp.ok:
@@ -247,6 +269,10 @@ def transcribe_from_url() -> None:
     pretty_print_response(resp)
 
 def main():
+    if not _AUTH_HEADERS:
+        print("No authentication configured. Set ENTRA_ACCESS_TOKEN or SPEECH_KEY.")
+        sys.exit(1)
+
     if AUDIO_FILE_PATH and os.path.isfile(AUDIO_FILE_PATH):
         print("Using inline file upload...")
         transcribe_inline_file()
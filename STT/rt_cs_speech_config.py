@@ -1,39 +1,61 @@
 from dotenv import load_dotenv
 
 import azure.cognitiveservices.speech as speechsdk
-import os
+import functools
+import logging
 import time
 
-load_dotenv()
-
-def stop_cb(evt):
-    print('CLOSING on {}'.format(evt))
-    speech_recognizer.stop_continuous_recognition()
-    global done
-    done = True
+try:
+    from stt_common import make_recognizer
+except ImportError:  # imported as part of the STT package
+    from STT.stt_common import make_recognizer
 
-speech_config = speechsdk.SpeechConfig(subscription=os.getenv('SPEECH_KEY'), region=os.getenv('REGION'))
-speech_config.speech_recognition_language="en-US"   # Source language config
+load_dotenv()
 
-'''
-speech_config.endpoint_id = "YourEndpointId"        # Custom endpoint config
-speech_config.set_property(speechsdk.PropertyId.Speech_SegmentationStrategy, "Semantic")    # Enable semantic segmentation
-'''
+# One shared callback for every SDK event: the native callback thread hands
+# the record to logging (lazy %-formatting, buffered handler) and returns,
+# instead of running a per-event lambda that formats and prints under the GIL.
+log = logging.getLogger("stt")
 
-audio_config = speechsdk.audio.AudioConfig(filename='data/synthesized_audio_data/tts_output.wav')
-speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+def _log_evt(tag, evt):
+    log.info("%s %s", tag, evt)
 
 done = False
 
-speech_recognizer.recognizing.connect(lambda evt: print('RECOGNIZING: {}'.format(evt)))
-speech_recognizer.recognized.connect(lambda evt: print('RECOGNIZED: {}'.format(evt)))
-speech_recognizer.session_started.connect(lambda evt: print('SESSION STARTED: {}'.format(evt)))
-speech_recognizer.session_stopped.connect(lambda evt: print('SESSION STOPPED {}'.format(evt)))
-speech_recognizer.canceled.connect(lambda evt: print('CANCELED {}'.format(evt)))
-
-speech_recognizer.session_stopped.connect(stop_cb)
-speech_recognizer.canceled.connect(stop_cb)
-
-speech_recognizer.start_continuous_recognition()
-while not done:
-    time.sleep(.5)
\ No newline at end of file
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    audio_config = speechsdk.audio.AudioConfig(filename='data/synthesized_audio_data/tts_output.wav')
+
+    def stop_cb(evt):
+        log.info("CLOSING on %s", evt)
+        speech_recognizer.stop_continuous_recognition()
+        global done
+        done = True
+
+    '''
+    For a custom endpoint / semantic segmentation, pass a tuned config:
+    cfg = stt_common.default_speech_config()
+    cfg.endpoint_id = "YourEndpointId"
+    cfg.set_property(speechsdk.PropertyId.Speech_SegmentationStrategy, "Semantic")
+    make_recognizer(audio_config, ..., speech_config=cfg)
+    '''
+
+    speech_recognizer = make_recognizer(
+        audio_config,
+        on_recognizing=functools.partial(_log_evt, "RECOGNIZING:"),
+        on_recognized=functools.partial(_log_evt, "RECOGNIZED:"),
+        on_session_started=functools.partial(_log_evt, "SESSION STARTED:"),
+        on_session_stopped=functools.partial(_log_evt, "SESSION STOPPED"),
+        on_canceled=functools.partial(_log_evt, "CANCELED"),
+    )
+
+    speech_recognizer.session_stopped.connect(stop_cb)
+    speech_recognizer.canceled.connect(stop_cb)
+
+    speech_recognizer.start_continuous_recognition()
+    while not done:
+        time.sleep(.5)
+
+if __name__ == "__main__":
+    main()
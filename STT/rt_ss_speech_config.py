@@ -1,13 +1,19 @@
 from dotenv import load_dotenv
 
+import functools
 import os
 import azure.cognitiveservices.speech as speechsdk
 
 load_dotenv()
 
+@functools.lru_cache(maxsize=1)
+def _get_config():
+    # Both entry points share one SpeechConfig; building it touches env and
+    # allocates a native object, so do that once per process.
+    return speechsdk.SpeechConfig(subscription=os.getenv('SPEECH_KEY'), region=os.getenv('REGION'))
+
 def from_mic():
-    speech_config = speechsdk.SpeechConfig(subscription=os.getenv('SPEECH_KEY'), region=os.getenv('REGION'))
-    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config)
+    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=_get_config())
 
     print("Speak into your microphone.")
     speech_recognition_result = speech_recognizer.recognize_once_async().get()
@@ -25,11 +31,11 @@ def from_mic():
             print("Did you set the speech resource key and region values?")
 
 def from_file():
-    speech_config = speechsdk.SpeechConfig(subscription=os.getenv('SPEECH_KEY'), region=os.getenv('REGION'))
     audio_config = speechsdk.AudioConfig(filename="testaudio.wav")
-    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+    speech_recognizer = speechsdk.SpeechRecognizer(speech_config=_get_config(), audio_config=audio_config)
 
     speech_recognition_result = speech_recognizer.recognize_once_async().get()
     print(speech_recognition_result.text)
 
-from_file()
+if __name__ == "__main__":
+    from_file()
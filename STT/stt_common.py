@@ -0,0 +1,59 @@
+"""
+Shared Speech SDK setup for the STT samples.
+
+The real-time samples and the folder daemon each built their own
+SpeechConfig and wired the same event callbacks by hand; this module keeps
+one factory so a process importing several of them does not initialize the
+SDK twice.
+"""
+
+import os
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+import azure.cognitiveservices.speech as speechsdk
+
+load_dotenv()
+
+
+def default_speech_config() -> speechsdk.SpeechConfig:
+    """SpeechConfig from SPEECH_KEY and SPEECH_REGION (or legacy REGION)."""
+    key = os.getenv("SPEECH_KEY", "")
+    region = os.getenv("SPEECH_REGION", "") or os.getenv("REGION", "")
+    if not key or not region:
+        raise RuntimeError("Set SPEECH_KEY and SPEECH_REGION in .env")
+    cfg = speechsdk.SpeechConfig(subscription=key, region=region)
+    cfg.speech_recognition_language = os.getenv("LOCALE", "en-US")
+    return cfg
+
+
+def make_recognizer(
+    audio_config: Optional[speechsdk.AudioConfig] = None,
+    on_recognized: Optional[Callable] = None,
+    on_recognizing: Optional[Callable] = None,
+    on_canceled: Optional[Callable] = None,
+    on_session_started: Optional[Callable] = None,
+    on_session_stopped: Optional[Callable] = None,
+    speech_config: Optional[speechsdk.SpeechConfig] = None,
+) -> speechsdk.SpeechRecognizer:
+    """
+    Build a SpeechRecognizer with the given audio source and wire up any
+    callbacks that were passed. Callers with custom tuning (segmentation,
+    custom endpoints, ...) pass their own speech_config; everyone else gets
+    the env-derived default.
+    """
+    cfg = speech_config or default_speech_config()
+    recognizer = speechsdk.SpeechRecognizer(speech_config=cfg, audio_config=audio_config)
+
+    if on_recognizing:
+        recognizer.recognizing.connect(on_recognizing)
+    if on_recognized:
+        recognizer.recognized.connect(on_recognized)
+    if on_canceled:
+        recognizer.canceled.connect(on_canceled)
+    if on_session_started:
+        recognizer.session_started.connect(on_session_started)
+    if on_session_stopped:
+        recognizer.session_stopped.connect(on_session_stopped)
+
+    return recognizer
@@ -1,135 +1,861 @@
-import os
-import time
-from pathlib import Path
-from typing import Optional
-
-from dotenv import load_dotenv
-import azure.cognitiveservices.speech as speechsdk
-
-load_dotenv()
-
-SPEECH_KEY   = os.getenv("SPEECH_KEY", "")
-SPEECH_REGION= os.getenv("SPEECH_REGION", "")
-CUSTOM_ENDPOINT_ID  = os.getenv("CUSTOM_ENDPOINT_ID", "")      # to follow: custom daemon endpoint id
-LOCALE       = os.getenv("LOCALE", "en-US")
-INPUT_DIR    = os.getenv("INPUT_DIR", "./incoming_audio")
-USE_MIC      = os.getenv("USE_MIC", "false").lower() == "true"
-
-# Segmentation component vars
-SEG_STRAT = os.getenv("SEGMENTATION_STRATEGY", "Semantic")  # Semantic | Coarse | Unknown
-SEG_INIT_SILENCE_TIMEOUT = os.getenv("SEGMENTATION_INIT_SILENCE_TIMEOUT_MS", "800")
-SEG_END_SILENCE_TIMEOUT = os.getenv("SEGMENTATION_END_SILENCE_TIMEOUT_MS", "800")
-
-def build_speech_config() -> speechsdk.SpeechConfig:
-    if not SPEECH_KEY or not SPEECH_REGION:
-        raise RuntimeError("Set SPEECH_KEY and SPEECH_REGION in .env")
-
-    cfg = speechsdk.SpeechConfig(subscription=SPEECH_KEY, region=SPEECH_REGION)
-    # source language
-    cfg.speech_recognition_language = LOCALE
-
-    # for the custom daemon's custom endpoint
-    if CUSTOM_ENDPOINT_ID:
-        cfg.endpoint_id = CUSTOM_ENDPOINT_ID 
-
-    # optional tuning:
-    cfg.set_profanity(speechsdk.ProfanityOption.Masked)
-    cfg.enable_dictation()  # allows continuous-like punctuation
-
-    # semantic segmentation
-    cfg.set_property(speechsdk.PropertyId.Speech_SegmentationStrategy, SEG_STRAT)
-    cfg.set_property(speechsdk.PropertyId.SpeechServiceConnection_InitialSilenceTimeoutMs, SEG_INIT_SILENCE_TIMEOUT)
-    cfg.set_property(speechsdk.PropertyId.SpeechServiceConnection_EndSilenceTimeoutMs, SEG_END_SILENCE_TIMEOUT)
-
-    return cfg
-
-def transcribe_file(wav_path: Path) -> Optional[str]:
-    cfg = build_speech_config()
-    audio_input = speechsdk.AudioConfig(filename=str(wav_path))
-    recognizer = speechsdk.SpeechRecognizer(speech_config=cfg, audio_config=audio_input)
-
-    print(f"[STT] Transcribing: {wav_path.name} (locale={LOCALE})")
-    
-    # recognize once per file (simple); longer files need chunking or batch/fast STT.
-    result = recognizer.recognize_once()
-
-    if result.reason == speechsdk.ResultReason.RecognizedSpeech:
-        print(f"[STT] Text: {result.text}")
-        return result.text
-    elif result.reason == speechsdk.ResultReason.NoMatch:
-        print("[STT] No speech could be recognized.")
-    else:
-        print(f"[STT] Error: {result.reason} {result.cancellation_details.error_details}")
-    return None
-
-def watch_folder():
-    input_dir = Path(INPUT_DIR)
-    input_dir.mkdir(parents=True, exist_ok=True)
-    print(f"[Daemon] Watching folder: {input_dir.resolve()} (drop .wav/.mp3/.mp4 etc.)")
-    print(f"[Segmentation] Strategy={SEG_STRAT}, SilenceTimeout=[Init: {SEG_INIT_SILENCE_TIMEOUT}ms, End: {SEG_END_SILENCE_TIMEOUT}ms")
-
-    seen = set()
-    try:
-        while True:
-            # naive polling for scale, use watchdog/inotify, etc.
-            for p in input_dir.iterdir():
-                if p.is_file() and p.suffix.lower() in {".wav", ".mp3", ".mp4", ".m4a", ".flac"} and p not in seen:
-                    seen.add(p)
-                    transcribe_file(p)
-            time.sleep(2)
-    except KeyboardInterrupt:
-        print("\n[Daemon] Stopped.")
-
-def transcribe_microphone():
-    """Continuous recognition to observe segmentation in action."""
-    cfg = build_speech_config()
-    audio_input = speechsdk.AudioConfig(use_default_microphone=True)
-    recognizer = speechsdk.SpeechRecognizer(speech_config=cfg, audio_config=audio_input)
-
-    print(f"[STT] Mic on (locale={LOCALE}) | Strategy={SEG_STRAT} | "
-          f"SilenceTimeout=[Init: {SEG_INIT_SILENCE_TIMEOUT}ms, End: {SEG_END_SILENCE_TIMEOUT}ms")
-    print("[STT] Speak; segments will appear as they are finalized. Press Ctrl+C to stop.\n")
-
-    # hook into events to see both interim and final segment text
-    def recognizing_cb(evt: speechsdk.SpeechRecognitionEventArgs):
-        # partial (interim) text while a segment is still forming
-        if evt.result.reason == speechsdk.ResultReason.RecognizingSpeech:
-            print(f"  [Interim] {evt.result.text}")
-
-    def recognized_cb(evt: speechsdk.SpeechRecognitionEventArgs):
-        # final text for the segment that just closed
-        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
-            print(f"[Segment] {evt.result.text}")
-        elif evt.result.reason == speechsdk.ResultReason.NoMatch:
-            print("[Segment] (no match)")
-
-    def session_started_cb(evt: speechsdk.SessionEventArgs):
-        print("[Session] Started")
-
-    def session_stopped_cb(evt: speechsdk.SessionEventArgs):
-        print("[Session] Stopped")
-
-    def canceled_cb(evt: speechsdk.SpeechRecognitionCanceledEventArgs):
-        print(f"[Canceled] {evt.reason} {evt.error_details}")
-
-    recognizer.recognizing.connect(recognizing_cb)
-    recognizer.recognized.connect(recognized_cb)
-    recognizer.session_started.connect(session_started_cb)
-    recognizer.session_stopped.connect(session_stopped_cb)
-    recognizer.canceled.connect(canceled_cb)
-
-    # start continuous recognition
-    recognizer.start_continuous_recognition()
-    try:
-        while True:
-            time.sleep(0.2)
-    except KeyboardInterrupt:
-        print("\n[STT] Stopping…")
-    finally:
-        recognizer.stop_continuous_recognition()
-
-if __name__ == "__main__":
-    if USE_MIC:
-        transcribe_microphone()
-    else:
-        watch_folder()
+import bisect
+import collections
+import functools
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+import azure.cognitiveservices.speech as speechsdk
+
+# Optional: event-driven folder watching (inotify on Linux). Falls back to
+# the polling loop below when watchdog is not installed.
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Optional: batch transcription for bursts of drops (see flush_pending).
+try:
+    from STT import bt_api
+except ImportError:
+    bt_api = None
+
+# Optional: upload local drops into the batch input container ourselves.
+try:
+    from azure.storage.blob import ContainerClient
+except ImportError:
+    ContainerClient = None
+
+from STT.stt_common import make_recognizer
+
+load_dotenv()
+
+# Hot-path logging goes through a queue: recognizer threads enqueue records
+# without taking the stdout lock, and one listener thread writes them out.
+log = logging.getLogger("stt_daemon")
+
+def _setup_logging() -> logging.handlers.QueueListener:
+    log_queue = queue.Queue(-1)
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    return listener
+
+_LOG_LISTENER = _setup_logging()
+
+SPEECH_KEY   = os.getenv("SPEECH_KEY", "")
+SPEECH_REGION= os.getenv("SPEECH_REGION", "")
+CUSTOM_ENDPOINT_ID  = os.getenv("CUSTOM_ENDPOINT_ID", "")      # to follow: custom daemon endpoint id
+LOCALE       = os.getenv("LOCALE", "en-US")
+INPUT_DIR    = os.getenv("INPUT_DIR", "./incoming_audio")
+USE_MIC      = os.getenv("USE_MIC", "false").lower() == "true"
+
+# Segmentation component vars
+SEG_STRAT = os.getenv("SEGMENTATION_STRATEGY", "Semantic")  # Semantic | Coarse | Unknown
+SEG_INIT_SILENCE_TIMEOUT = os.getenv("SEGMENTATION_INIT_SILENCE_TIMEOUT_MS", "800")
+SEG_END_SILENCE_TIMEOUT = os.getenv("SEGMENTATION_END_SILENCE_TIMEOUT_MS", "800")
+
+# Cap on the processed-files LRU in the polling fallback
+SEEN_MAX_ENTRIES = int(os.getenv("SEEN_MAX_ENTRIES", "10000"))
+
+# Batch routing: once this many drops accumulate, submit one batch
+# transcription job instead of N real-time recognitions. Requires the
+# incoming folder to be mirrored into bt_api's input container (SAS).
+BATCH_THRESHOLD = int(os.getenv("BATCH_THRESHOLD", "8"))
+BATCH_MAX_WAIT_SECONDS = float(os.getenv("BATCH_MAX_WAIT_SECONDS", "30"))
+
+# Real-time recognitions in flight at once (network-bound, so the GIL is not
+# the limit), plus a small stagger between submits so a burst of files does
+# not open all its TLS handshakes in the same instant.
+STT_CONCURRENCY = int(os.getenv("STT_CONCURRENCY", "16"))
+ASYNC_DELAY_MS = float(os.getenv("ASYNC_DELAY_MS", "50"))
+
+# recognize_once only covers short audio; files at or above this size go
+# straight to the batch API instead of being silently truncated.
+LARGE_FILE_BYTES = int(os.getenv("LARGE_FILE_BYTES", str(25 * 1024 * 1024)))
+
+# WAV files below this size count as short utterances: bursts of them are
+# stitched into one continuous-recognition session (see flush_micro_batch)
+# so the websocket/TLS setup is paid once for the burst rather than per file.
+SHORT_FILE_THRESHOLD = int(os.getenv("SHORT_FILE_THRESHOLD", str(512 * 1024)))
+MICRO_BATCH_SILENCE_MS = int(os.getenv("MICRO_BATCH_SILENCE_MS", "300"))
+
+# Content-addressed transcript cache: re-dropped or re-run audio is answered
+# from disk instead of paying the Azure round-trip again.
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "./stt_cache"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+
+# Upper bound on a single file's continuous-recognition session, so a hung
+# network cannot stall a worker forever.
+FILE_RECOGNITION_TIMEOUT_SECONDS = float(os.getenv("FILE_RECOGNITION_TIMEOUT_SECONDS", "600"))
+
+# Transient websocket/EOF failures get this many retries before a file is
+# declared failed for good.
+MAX_RECOGNIZE_RETRIES = int(os.getenv("MAX_RECOGNIZE_RETRIES", "3"))
+
+# Error-detail fragments that indicate a transient network failure worth
+# retrying (dropped websocket, unexpected EOF) rather than a bad file.
+_TRANSIENT_ERROR_MARKERS = ("EOF", "0x9", "Connection", "timeout")
+
+# Pre-flight transcode: the service's fast path is 16 kHz mono 16-bit PCM,
+# and 44.1 kHz stereo sources transfer several times the bytes only to be
+# resampled server-side. Skipped transparently when ffmpeg is not on PATH.
+_FFMPEG = shutil.which("ffmpeg")
+
+def _ensure_pcm16k(path: Path, digest: str) -> Path:
+    """
+    Return a 16 kHz mono s16 WAV for the given source, converting with
+    ffmpeg on first sight and reusing the cached conversion (keyed by the
+    source content hash) afterwards. Falls back to the original file when
+    ffmpeg is missing or the conversion fails.
+    """
+    if _FFMPEG is None:
+        return path
+    out = CACHE_DIR / f"{digest}_16k.wav"
+    if out.exists():
+        return out
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_DIR / f"{digest}_16k.tmp.wav"
+    try:
+        subprocess.run(
+            [_FFMPEG, "-y", "-i", str(path),
+             "-ac", "1", "-ar", "16000", "-sample_fmt", "s16",
+             "-f", "wav", str(tmp)],
+            check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        tmp.unlink(missing_ok=True)
+        log.warning("[STT] ffmpeg conversion failed for %s: %s",
+                    path.name, e.stderr.decode(errors="replace").strip()[-200:])
+        return path  # let the SDK try the original
+    tmp.replace(out)  # atomic: readers never see a half-written WAV
+    return out
+
+def _content_hash(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        # 1 MiB chunks bound RAM regardless of audio size
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _trim_cache():
+    # Transcripts and converted WAVs are capped independently, oldest first.
+    for pattern in ("*.txt", "*_16k.wav"):
+        entries = sorted(CACHE_DIR.glob(pattern), key=lambda p: p.stat().st_mtime)
+        for stale in entries[:max(0, len(entries) - CACHE_MAX_ENTRIES)]:
+            stale.unlink(missing_ok=True)
+
+def _open_seen_db() -> sqlite3.Connection:
+    """Processed-file ledger that survives restarts (unlike the in-memory LRU)."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(CACHE_DIR / "seen.db"))
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS seen ("
+        " path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, hits INTEGER DEFAULT 0)"
+    )
+    return db
+
+def _seen_in_db(db: sqlite3.Connection, path: str, st: os.stat_result) -> bool:
+    row = db.execute(
+        "SELECT 1 FROM seen WHERE path=? AND mtime=? AND size=?",
+        (path, int(st.st_mtime), st.st_size),
+    ).fetchone()
+    if row:
+        db.execute("UPDATE seen SET hits=hits+1 WHERE path=?", (path,))
+        db.commit()
+        return True
+    return False
+
+def _record_seen(db: sqlite3.Connection, path: str, st: os.stat_result):
+    db.execute(
+        "INSERT OR REPLACE INTO seen(path, mtime, size, hits) VALUES (?, ?, ?, 0)",
+        (path, int(st.st_mtime), st.st_size),
+    )
+    # Least-frequently-used rows go first once the cap is exceeded.
+    (count,) = db.execute("SELECT COUNT(*) FROM seen").fetchone()
+    if count > SEEN_MAX_ENTRIES:
+        db.execute(
+            "DELETE FROM seen WHERE path IN"
+            " (SELECT path FROM seen ORDER BY hits ASC LIMIT ?)",
+            (count - SEEN_MAX_ENTRIES,),
+        )
+    db.commit()
+
+_POOL = ThreadPoolExecutor(max_workers=STT_CONCURRENCY)
+
+@functools.lru_cache(maxsize=None)
+def build_speech_config(locale: str = LOCALE,
+                        endpoint_id: str = CUSTOM_ENDPOINT_ID) -> speechsdk.SpeechConfig:
+    # Cached per (locale, endpoint): every caller with the same tuning shares
+    # one native config object, and env validation failures surface on first
+    # use rather than at import.
+    if not SPEECH_KEY or not SPEECH_REGION:
+        raise RuntimeError("Set SPEECH_KEY and SPEECH_REGION in .env")
+
+    cfg = speechsdk.SpeechConfig(subscription=SPEECH_KEY, region=SPEECH_REGION)
+    # source language
+    cfg.speech_recognition_language = locale
+
+    # for the custom daemon's custom endpoint
+    if endpoint_id:
+        cfg.endpoint_id = endpoint_id
+
+    # optional tuning:
+    cfg.set_profanity(speechsdk.ProfanityOption.Masked)
+    cfg.enable_dictation()  # allows continuous-like punctuation
+
+    # semantic segmentation
+    cfg.set_property(speechsdk.PropertyId.Speech_SegmentationStrategy, SEG_STRAT)
+    cfg.set_property(speechsdk.PropertyId.SpeechServiceConnection_InitialSilenceTimeoutMs, SEG_INIT_SILENCE_TIMEOUT)
+    cfg.set_property(speechsdk.PropertyId.SpeechServiceConnection_EndSilenceTimeoutMs, SEG_END_SILENCE_TIMEOUT)
+
+    return cfg
+
+def transcribe_file(wav_path: Path, cfg: Optional[speechsdk.SpeechConfig] = None) -> Optional[str]:
+    """
+    Transcribe one file. Returns the text, or None when a clean session
+    found no speech; raises RuntimeError once transient-error retries are
+    exhausted so callers can tell failure from silence.
+    """
+    # Building SpeechConfig re-validates env and constructs a native object
+    # graph; daemon callers pass one prebuilt config for all files.
+    if cfg is None:
+        cfg = build_speech_config()
+
+    # Duplicate drops (and re-runs) short-circuit on content hash.
+    digest = _content_hash(wav_path)
+    cached = CACHE_DIR / f"{digest}.txt"
+    if cached.exists():
+        text = cached.read_text()
+        log.info("[STT] Cached: %s", wav_path.name)
+        return text
+
+    log.info("[STT] Transcribing: %s (locale=%s)", wav_path.name, LOCALE)
+
+    # Normalize to the service's preferred format before upload; compressed
+    # containers decoded here also skip the SDK-side GStreamer pipeline.
+    source = _ensure_pcm16k(wav_path, digest)
+
+    def _run_session():
+        # Continuous recognition so files longer than recognize_once's ~15 s
+        # window come back complete: collect each finalized segment and stop
+        # when the session ends (or errors).
+        parts = []
+        errors = []
+        done = threading.Event()
+
+        def _collect(evt):
+            if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
+                parts.append(evt.result.text)
+
+        def _canceled(evt):
+            if evt.reason == speechsdk.CancellationReason.Error:
+                errors.append(evt.error_details)
+            done.set()
+
+        recognizer = make_recognizer(
+            _audio_config_for(source),
+            on_recognized=_collect,
+            on_canceled=_canceled,
+            on_session_stopped=lambda evt: done.set(),
+            speech_config=cfg,
+        )
+
+        recognizer.start_continuous_recognition()
+        if not done.wait(timeout=FILE_RECOGNITION_TIMEOUT_SECONDS):
+            # A hung session is as inconclusive as an errored one: whatever
+            # segments arrived so far may not cover the whole file.
+            errors.append(f"timeout after {FILE_RECOGNITION_TIMEOUT_SECONDS:.0f}s")
+        recognizer.stop_continuous_recognition()
+        return parts, errors
+
+    parts = []
+    errors = []
+    for attempt in range(MAX_RECOGNIZE_RETRIES + 1):
+        parts, errors = _run_session()
+        if not errors:
+            break
+        # Segments recognized before a mid-file failure are NOT a complete
+        # transcript; only a clean session ends the loop.
+        transient = any(marker in (err or "") for err in errors
+                        for marker in _TRANSIENT_ERROR_MARKERS)
+        if not transient or attempt == MAX_RECOGNIZE_RETRIES:
+            break
+        # Capped exponential backoff with jitter so retrying workers
+        # don't re-hammer the endpoint in lockstep.
+        wait = min(30, 2 ** attempt) + random.random()
+        log.info("[STT] Transient error (%s); retry %d/%d in %.1fs", errors[0], attempt + 1, MAX_RECOGNIZE_RETRIES, wait)
+        time.sleep(wait)
+
+    if errors:
+        # Log the SDK's details so operators can tell transient from
+        # permanent failures. Never cache (or return) a possibly-truncated
+        # transcript: a cached partial would answer every future duplicate.
+        log.warning("[STT] Error: %s", errors[0])
+        raise RuntimeError(f"recognition failed for {wav_path.name}: {errors[0]}")
+    if parts:
+        text = " ".join(parts)
+        log.info("[STT] Text: %s", text)
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cached.write_text(text)
+        _trim_cache()
+        return text
+    log.info("[STT] No speech could be recognized.")
+    return None
+
+AUDIO_EXTS = frozenset({".wav", ".mp3", ".mp4", ".m4a", ".flac"})
+# Tuple form for str.endswith in the scan loop (no per-entry Path/suffix work)
+AUDIO_EXT_SUFFIXES = tuple(sorted(AUDIO_EXTS))
+
+# Compressed containers need the push-stream pipeline (GStreamer decode on
+# the SDK side); plain WAV keeps the simple filename-based AudioConfig.
+_COMPRESSED_FORMATS = {
+    ".mp3": "MP3",
+    ".flac": "FLAC",
+    ".mp4": "ANY",
+    ".m4a": "ANY",
+}
+
+def _feed_push_stream(path: Path, push: "speechsdk.audio.PushAudioInputStream"):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            push.write(chunk)
+    push.close()
+
+def _audio_config_for(path: Path) -> speechsdk.AudioConfig:
+    """
+    Filename config for WAV; a PushAudioInputStream fed from a background
+    thread for compressed containers, so MP3/MP4/M4A/FLAC drops decode
+    through the SDK instead of failing in the WAV-only file reader.
+    """
+    fmt_name = _COMPRESSED_FORMATS.get(path.suffix.lower())
+    if fmt_name is None:
+        return speechsdk.AudioConfig(filename=str(path))
+    container = getattr(speechsdk.AudioStreamContainerFormat, fmt_name)
+    stream_format = speechsdk.audio.AudioStreamFormat(compressed_stream_format=container)
+    push = speechsdk.audio.PushAudioInputStream(stream_format)
+    threading.Thread(target=_feed_push_stream, args=(path, push), daemon=True).start()
+    return speechsdk.AudioConfig(stream=push)
+
+def batch_available() -> bool:
+    """Batch routing needs bt_api plus its input/output container SAS URLs."""
+    return (bt_api is not None
+            and bool(bt_api.INPUT_CONTAINER_SAS_URL)
+            and bool(bt_api.OUTPUT_CONTAINER_SAS_URL))
+
+def _blob_sas_url(name: str) -> str:
+    """Per-blob URL carrying the input container's SAS query string."""
+    base, _, query = bt_api.INPUT_CONTAINER_SAS_URL.partition("?")
+    url = f"{base.rstrip('/')}/{urllib.parse.quote(name)}"
+    return f"{url}?{query}" if query else url
+
+def transcribe_batch(paths: list) -> dict:
+    """
+    Cover many (or very long) local files with one batch transcription job.
+    When azure-storage-blob is installed the files are uploaded into the
+    input container first; otherwise the folder is assumed to be mirrored
+    there already. The job is scoped to exactly these blobs via contentUrls
+    (a container-wide job would re-transcribe every earlier upload too), and
+    server-side parallelism then does the heavy lifting.
+    """
+    if not batch_available():
+        raise RuntimeError("Batch transcription is not configured (bt_api + container SAS URLs).")
+    if ContainerClient is not None:
+        container = ContainerClient.from_container_url(bt_api.INPUT_CONTAINER_SAS_URL)
+        for p in paths:
+            with open(p, "rb") as f:
+                container.upload_blob(p.name, f, overwrite=True)
+    job_id = bt_api.submit_job(content_urls=[_blob_sas_url(p.name) for p in paths])
+    job = bt_api.monitor_until_done(job_id)
+    status = job.get("status") or job.get("state")
+    log.info("[Daemon] Batch job %s: %s", job_id, status)
+    if status != "Succeeded":
+        # A Failed/Cancelled job covered nobody; callers must not mark
+        # these files as processed.
+        raise RuntimeError(f"batch job {job_id} ended {status}")
+    return job
+
+def _micro_batch_eligible(p: Path) -> bool:
+    try:
+        return p.suffix.lower() == ".wav" and p.stat().st_size < SHORT_FILE_THRESHOLD
+    except OSError:
+        return False  # vanished between event and flush
+
+def flush_micro_batch(paths: list, cfg: Optional[speechsdk.SpeechConfig] = None) -> dict:
+    """
+    Transcribe a burst of short WAV files over ONE continuous-recognition
+    session. Their PCM payloads are concatenated (with a short silence gap
+    between files) into a single PushAudioInputStream, so the TLS handshake
+    and websocket setup are amortized across the whole burst. Recognized
+    events are mapped back to source files by bisecting the event's stream
+    offset against a cumulative end-offset table.
+
+    All files must share the same WAV parameters; callers fall back to the
+    per-file path when this raises. When the shared session errors, every
+    file it streamed is left out of the returned dict (nothing is cached)
+    so callers retry them individually; a None value means a clean session
+    genuinely found no speech.
+    """
+    if cfg is None:
+        cfg = build_speech_config()
+
+    results = {}
+    digests = {}
+    to_stream = []
+    for p in paths:
+        digests[p] = _content_hash(p)
+        cached = CACHE_DIR / f"{digests[p]}.txt"
+        if cached.exists():
+            log.info("[STT] Cached: %s", p.name)
+            results[p] = cached.read_text()
+        else:
+            to_stream.append(p)
+    if not to_stream:
+        return results
+
+    with wave.open(str(to_stream[0]), "rb") as w:
+        rate, width, channels = w.getframerate(), w.getsampwidth(), w.getnchannels()
+    gap_pcm = b"\x00" * (rate * width * channels * MICRO_BATCH_SILENCE_MS // 1000)
+    gap_ticks = MICRO_BATCH_SILENCE_MS * 10_000  # SDK offsets are 100 ns ticks
+
+    # Cumulative offset table: ends[i] is the stream tick at which file i's
+    # audio finishes; bisect on a recognized event's offset finds its source.
+    pcm_chunks = []
+    ends = []
+    cursor = 0
+    for p in to_stream:
+        with wave.open(str(p), "rb") as w:
+            if (w.getframerate(), w.getsampwidth(), w.getnchannels()) != (rate, width, channels):
+                raise ValueError(f"{p.name}: WAV parameters differ within micro-batch")
+            pcm = w.readframes(w.getnframes())
+        pcm_chunks.append(pcm)
+        cursor += len(pcm) * 10_000_000 // (rate * width * channels)
+        ends.append(cursor)
+        pcm_chunks.append(gap_pcm)
+        cursor += gap_ticks
+
+    log.info("[STT] Micro-batch: %d short files in one session", len(to_stream))
+
+    parts = collections.defaultdict(list)
+    errors = []
+    done = threading.Event()
+
+    def _collect(evt):
+        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            idx = min(bisect.bisect_right(ends, evt.result.offset), len(to_stream) - 1)
+            parts[to_stream[idx]].append(evt.result.text)
+
+    def _canceled(evt):
+        if evt.reason == speechsdk.CancellationReason.Error:
+            errors.append(evt.error_details)
+        done.set()
+
+    stream_format = speechsdk.audio.AudioStreamFormat(
+        samples_per_second=rate, bits_per_sample=width * 8, channels=channels)
+    push = speechsdk.audio.PushAudioInputStream(stream_format)
+
+    def _feed():
+        for chunk in pcm_chunks:
+            push.write(chunk)
+        push.close()
+
+    threading.Thread(target=_feed, daemon=True).start()
+
+    recognizer = make_recognizer(
+        speechsdk.AudioConfig(stream=push),
+        on_recognized=_collect,
+        on_canceled=_canceled,
+        on_session_stopped=lambda evt: done.set(),
+        speech_config=cfg,
+    )
+    recognizer.start_continuous_recognition()
+    done.wait(timeout=FILE_RECOGNITION_TIMEOUT_SECONDS)
+    recognizer.stop_continuous_recognition()
+
+    if errors:
+        # An errored session proves nothing about any streamed file -- the
+        # one in flight at the failure has only partial segments, and the
+        # exact failure offset is unknowable. Cache and report nothing, so
+        # the caller's per-file path (with its own retries) re-does them all.
+        log.warning("[STT] Error: %s", errors[0])
+        return results
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for p in to_stream:
+        if parts.get(p):
+            text = " ".join(parts[p])
+            results[p] = text
+            log.info("[STT] Text (%s): %s", p.name, text)
+            (CACHE_DIR / f"{digests[p]}.txt").write_text(text)
+        else:
+            results[p] = None  # clean session, genuinely silent file
+    _trim_cache()
+    return results
+
+def flush_pending(pending: list, cfg: speechsdk.SpeechConfig) -> set:
+    """
+    Drain accumulated drops. Large bursts go to the Batch Transcription API
+    as one submission (one auth/session setup, one poll stream for N files);
+    small batches stay on the per-file real-time path.
+
+    Returns the set of paths that reached a definitive terminal state
+    (transcript, cache hit, or clean no-speech). Files whose recognition
+    failed -- exhausted retries, dead batch job -- are absent so callers
+    can retry them instead of marking them processed.
+    """
+    if not pending:
+        return set()
+    done_paths = set()
+    if batch_available() and len(pending) >= BATCH_THRESHOLD:
+        log.info("[Daemon] Routing %d accumulated files to batch transcription", len(pending))
+        try:
+            transcribe_batch(pending)
+            done_paths.update(pending)
+        except Exception:
+            log.exception("[Daemon] Batch flush failed; %d files left for retry", len(pending))
+    else:
+        # Bursts of short WAVs share one continuous session; anything left
+        # (compressed, long, or mismatched WAVs) fans out per file.
+        remainder = list(pending)
+        short = [p for p in remainder if _micro_batch_eligible(p)]
+        if len(short) >= 2:
+            try:
+                results = flush_micro_batch(short, cfg)
+                # Only drop files the session actually covered; anything the
+                # session died before reaching gets transcribe_file's own
+                # per-file retry path below.
+                covered = [p for p in short if p in results]
+                done_paths.update(covered)
+                remainder = [p for p in remainder if p not in covered]
+            except Exception as e:
+                # Mixed WAV params, truncated/empty files (EOFError from
+                # wave.open), vanished paths: per-file path sorts them out.
+                log.warning("[STT] Micro-batch fell back to per-file: %s", e)
+        # Fan the files out across the recognizer pool and wait for the lot;
+        # waiting keeps backpressure on the watcher so a huge backlog can't
+        # queue unbounded work.
+        futures = []
+        for p in remainder:
+            futures.append((p, _POOL.submit(transcribe_file, p, cfg)))
+            time.sleep(ASYNC_DELAY_MS / 1000)
+        for p, fut in futures:
+            try:
+                fut.result()
+                done_paths.add(p)
+            except Exception:
+                log.exception("[STT] %s failed; left for retry", p.name)
+    pending.clear()
+    return done_paths
+
+def _submit_transcription(p: Path, cfg: speechsdk.SpeechConfig):
+    """
+    Fire-and-forget pool submission for the event-driven path: the observer's
+    dispatch thread must not transcribe inline (one slow file would stall
+    every subsequent event), and a worker failure is logged rather than left
+    to die silently in an unobserved future.
+    """
+    def _run():
+        try:
+            transcribe_file(p, cfg)
+        except Exception:
+            log.exception("[STT] %s failed", p.name)
+    _POOL.submit(_run)
+
+class _NewAudioHandler(FileSystemEventHandler):
+    """Transcribes audio files as the kernel reports them being dropped."""
+
+    def __init__(self, cfg: speechsdk.SpeechConfig):
+        self.cfg = cfg
+        self.pending = []
+        self.first_pending_at = 0.0
+        # Files whose create event fired but whose writer may still be going:
+        # path -> last observed size. Promoted once the size stops changing.
+        self._settling = {}
+        # Events arrive on the observer thread while the deadline flush runs
+        # on the main thread; the lock keeps the batch state consistent.
+        self._lock = threading.Lock()
+
+    def on_created(self, event):
+        # The create event fires when the file is opened, not when the
+        # writer finishes; transcribing immediately would hash and cache a
+        # half-written file. Hold it until its size settles (see
+        # promote_settled), which the watch loop checks every second.
+        path = getattr(event, "src_path", "")
+        if path:
+            with self._lock:
+                self._settling[path] = -1
+
+    def on_moved(self, event):
+        # Files moved/renamed into the folder (e.g., atomic tmp->final
+        # renames) are complete by definition, so no settle delay.
+        self._maybe_transcribe(getattr(event, "dest_path", ""))
+
+    def promote_settled(self):
+        """Transcribe created files whose size held steady since last check."""
+        ready = []
+        with self._lock:
+            for path, last_size in list(self._settling.items()):
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    # Vanished (temp file, or renamed -> on_moved covers it).
+                    del self._settling[path]
+                    continue
+                if size == last_size:
+                    del self._settling[path]
+                    ready.append(path)
+                else:
+                    self._settling[path] = size
+        for path in ready:
+            self._maybe_transcribe(path)
+
+    def _take_pending(self):
+        # Caller must hold self._lock. Swapping the list out lets the flush
+        # itself run unlocked: flush_pending can sit in a batch poll for
+        # minutes, and holding the lock that long would freeze event intake
+        # and promote_settled.
+        batch = self.pending
+        self.pending = []
+        return batch
+
+    def flush_if_due(self):
+        """
+        Flush a below-threshold batch once its deadline passes. A quiet
+        folder produces no further events to re-check the clock, so the
+        watch loop calls this periodically from the main thread.
+        """
+        with self._lock:
+            due = bool(self.pending) and time.time() - self.first_pending_at >= BATCH_MAX_WAIT_SECONDS
+            batch = self._take_pending() if due else []
+        if batch:
+            flush_pending(batch, self.cfg)
+
+    def _maybe_transcribe(self, path: str):
+        p = Path(path)
+        if not (path and p.is_file() and p.suffix.lower() in AUDIO_EXTS):
+            return
+        if not batch_available():
+            # Hand off to the recognizer pool: recognitions overlap up to
+            # STT_CONCURRENCY instead of serializing on this thread.
+            _submit_transcription(p, self.cfg)
+            return
+        try:
+            size = p.stat().st_size
+        except OSError:
+            return  # vanished between event and handling
+        if size >= LARGE_FILE_BYTES:
+            # Too long for recognize_once; don't hold it back for a burst.
+            # An exception here must not kill the observer's dispatch thread.
+            try:
+                transcribe_batch([p])
+            except Exception:
+                log.exception("[Daemon] Batch for %s failed", p.name)
+            return
+        with self._lock:
+            if not self.pending:
+                self.first_pending_at = time.time()
+            self.pending.append(p)
+            flush_now = (len(self.pending) >= BATCH_THRESHOLD
+                         or time.time() - self.first_pending_at >= BATCH_MAX_WAIT_SECONDS)
+            batch = self._take_pending() if flush_now else []
+        if batch:
+            flush_pending(batch, self.cfg)
+
+def watch_folder():
+    input_dir = Path(INPUT_DIR)
+    input_dir.mkdir(parents=True, exist_ok=True)
+    log.info("[Daemon] Watching folder: %s (drop .wav/.mp3/.mp4 etc.)", input_dir.resolve())
+    log.info("[Segmentation] Strategy=%s, SilenceTimeout=[Init: %sms, End: %sms", SEG_STRAT, SEG_INIT_SILENCE_TIMEOUT, SEG_END_SILENCE_TIMEOUT)
+
+    # One SpeechConfig for the daemon's lifetime; only the per-file
+    # AudioConfig + recognizer are rebuilt per transcription.
+    cfg = build_speech_config()
+
+    if Observer is not None:
+        # Event-driven: one blocking kernel watch instead of re-scanning the
+        # directory every 2 s, and no need to track already-seen files.
+        handler = _NewAudioHandler(cfg)
+        observer = Observer()
+        observer.schedule(handler, str(input_dir), recursive=False)
+        observer.start()
+        # With the watch established, sweep once so files dropped while the
+        # daemon was down are still picked up.
+        for p in input_dir.iterdir():
+            handler._maybe_transcribe(str(p))
+        try:
+            # Not a bare observer.join(): settling files and the batch
+            # deadline must be re-checked even when no further filesystem
+            # event arrives to trigger them. One bad file or failed API call
+            # must not take the daemon down with it.
+            while observer.is_alive():
+                try:
+                    handler.promote_settled()
+                    handler.flush_if_due()
+                except Exception:
+                    log.exception("[Daemon] Periodic maintenance failed; continuing")
+                time.sleep(1)
+        except KeyboardInterrupt:
+            log.info("[Daemon] Stopped.")
+        finally:
+            observer.stop()
+            observer.join()
+        return
+
+    log.info("[Daemon] watchdog not installed; falling back to polling.")
+    # Bounded LRU of processed files keyed on inode: containment is an int
+    # hash, a re-upload (new file object, same name) is transcribed again,
+    # and the cap keeps memory flat however long the daemon runs.
+    seen = collections.OrderedDict()
+    db = _open_seen_db()
+    pending = []
+    # Ledger rows are written only after a file's flush completes; recording
+    # up front would make a crash mid-transcription skip the file forever.
+    pending_meta = {}
+    first_pending_at = 0.0
+    try:
+        while True:
+            # One bad file (vanished mid-scan, truncated WAV, failed API
+            # call) must not escape the loop and kill the daemon.
+            try:
+                # scandir reuses the stat data from the directory read, so
+                # is_file/stat cost no extra syscall per entry.
+                with os.scandir(input_dir) as it:
+                    for entry in it:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        # Already-seen files are the common case, so check the
+                        # inode before paying for the per-entry name lowering.
+                        st = entry.stat()
+                        if st.st_ino in seen:
+                            seen.move_to_end(st.st_ino)
+                            continue
+                        if not entry.name.lower().endswith(AUDIO_EXT_SUFFIXES):
+                            continue
+                        seen[st.st_ino] = None
+                        if len(seen) > SEEN_MAX_ENTRIES:
+                            seen.popitem(last=False)
+                        # Disk ledger: skip files processed before a restart.
+                        # Interned so re-scans (and the sqlite rows' Python-side
+                        # copies) share one string object per path instead of
+                        # allocating a fresh ~100 B str every pass.
+                        path_key = sys.intern(os.path.abspath(entry.path))
+                        if _seen_in_db(db, path_key, st):
+                            continue
+                        p = Path(entry.path)
+                        if batch_available() and st.st_size >= LARGE_FILE_BYTES:
+                            try:
+                                transcribe_batch([p])
+                                _record_seen(db, path_key, st)
+                            except Exception:
+                                # Forget the inode so the next scan retries it.
+                                log.exception("[Daemon] Batch for %s failed; left for retry", p.name)
+                                seen.pop(st.st_ino, None)
+                            continue
+                        if not pending:
+                            first_pending_at = time.time()
+                        pending.append(p)
+                        pending_meta[p] = (path_key, st)
+                # Flush on burst size or once the oldest pending file has waited
+                # long enough; below-threshold flushes take the real-time path.
+                if pending and (len(pending) >= BATCH_THRESHOLD
+                                or time.time() - first_pending_at >= BATCH_MAX_WAIT_SECONDS
+                                or not batch_available()):
+                    flushed = list(pending)
+                    done_paths = flush_pending(pending, cfg)
+                    # Only definitive outcomes (transcript, cache hit, clean
+                    # no-speech) enter the ledger; failures also drop out of the
+                    # inode LRU so the next scan retries them.
+                    for p in flushed:
+                        key_st = pending_meta.pop(p, None)
+                        if key_st is None:
+                            continue
+                        path_key, p_st = key_st
+                        if p in done_paths:
+                            _record_seen(db, path_key, p_st)
+                        else:
+                            seen.pop(p_st.st_ino, None)
+            except Exception:
+                log.exception("[Daemon] Scan pass failed; retrying next cycle")
+            time.sleep(2)
+    except KeyboardInterrupt:
+        log.info("[Daemon] Stopped.")
+
+def transcribe_microphone():
+    """Continuous recognition to observe segmentation in action."""
+    cfg = build_speech_config()
+    audio_input = speechsdk.AudioConfig(use_default_microphone=True)
+
+    log.info("[STT] Mic on (locale=%s) | Strategy=%s | SilenceTimeout=[Init: %sms, End: %sms",
+             LOCALE, SEG_STRAT, SEG_INIT_SILENCE_TIMEOUT, SEG_END_SILENCE_TIMEOUT)
+    log.info("[STT] Speak; segments will appear as they are finalized. Press Ctrl+C to stop.")
+
+    # The main thread parks on this event instead of spinning in a sleep
+    # loop; the SDK's callback threads wake it when the session ends.
+    done = threading.Event()
+
+    # hook into events to see both interim and final segment text
+    def recognizing_cb(evt: speechsdk.SpeechRecognitionEventArgs):
+        # partial (interim) text while a segment is still forming
+        if evt.result.reason == speechsdk.ResultReason.RecognizingSpeech:
+            log.info("  [Interim] %s", evt.result.text)
+
+    def recognized_cb(evt: speechsdk.SpeechRecognitionEventArgs):
+        # final text for the segment that just closed
+        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            log.info("[Segment] %s", evt.result.text)
+        elif evt.result.reason == speechsdk.ResultReason.NoMatch:
+            log.info("[Segment] (no match)")
+
+    def session_started_cb(evt: speechsdk.SessionEventArgs):
+        log.info("[Session] Started")
+
+    def session_stopped_cb(evt: speechsdk.SessionEventArgs):
+        log.info("[Session] Stopped")
+        done.set()
+
+    def canceled_cb(evt: speechsdk.SpeechRecognitionCanceledEventArgs):
+        log.info("[Canceled] %s %s", evt.reason, evt.error_details)
+        done.set()
+
+    recognizer = make_recognizer(
+        audio_input,
+        on_recognizing=recognizing_cb,
+        on_recognized=recognized_cb,
+        on_canceled=canceled_cb,
+        on_session_started=session_started_cb,
+        on_session_stopped=session_stopped_cb,
+        speech_config=cfg,
+    )
+
+    # start continuous recognition and block until the session ends;
+    # Event.wait() sleeps in the kernel rather than waking 5x per second.
+    recognizer.start_continuous_recognition()
+    try:
+        done.wait()
+    except KeyboardInterrupt:
+        log.info("[STT] Stopping…")
+    finally:
+        recognizer.stop_continuous_recognition()
+
+if __name__ == "__main__":
+    if USE_MIC:
+        transcribe_microphone()
+    else:
+        watch_folder()